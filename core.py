@@ -0,0 +1,127 @@
+# Connection and friend request state used by the routes in main.py. Kept
+# fully annotated and free of route decorators so it can be compiled with
+# mypyc; main.py imports it the same way whether or not it is compiled.
+import asyncio
+
+import msgpack  # type: ignore[import-untyped]
+from fastapi import WebSocket, WebSocketDisconnect
+
+# Pending friend requests, stored column-wise. A request id is its index in
+# the columns; accepted requests are tombstoned with None.
+class FriendRequestsStore:
+    def __init__(self) -> None:
+        self.from_: list[str | None] = []
+        self.to_: list[str | None] = []
+
+    def add(self, from_user: str, to_user: str) -> int:
+        self.from_.append(from_user)
+        self.to_.append(to_user)
+        return len(self.to_) - 1
+
+    def get(self, request_id: int) -> tuple[str, str] | None:
+        if 0 <= request_id < len(self.to_):
+            from_user = self.from_[request_id]
+            to_user = self.to_[request_id]
+            if from_user is not None and to_user is not None:
+                return from_user, to_user
+        return None
+
+    def remove(self, request_id: int) -> None:
+        self.from_[request_id] = None
+        self.to_[request_id] = None
+
+# One open WebSocket with its own outbound queue and writer task
+class Session:
+    def __init__(self, user_id: str, websocket: WebSocket, queue_size: int) -> None:
+        self.user_id = user_id
+        self.websocket = websocket
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=queue_size)
+        self.writer: asyncio.Task[None] | None = None
+
+# Manage real-time conversations
+class ConnectionManager:
+    # Outbound messages are queued per session and sent by a dedicated writer
+    # task, so a slow client never blocks the sender or the other clients.
+    queue_size = 256
+    # Payloads are msgpack-encoded once and the same bytes are shared by every
+    # queue. msgpack objects are self-delimiting, so pending messages are
+    # coalesced by concatenating them into one binary frame.
+    batch_max_messages = 32
+    batch_max_bytes = 64 * 1024
+
+    def __init__(self) -> None:
+        # Open sessions per user, oldest first; messages addressed to a user
+        # go to their most recent one
+        self.user_sessions: dict[str, list[Session]] = {}
+        # Chat sessions currently open on each conversation
+        self.conversation_sessions: dict[str, list[Session]] = {}
+
+    async def connect(self, user_id: str, websocket: WebSocket) -> Session:
+        await websocket.accept()
+        session = Session(user_id, websocket, self.queue_size)
+        session.writer = asyncio.create_task(self._writer(websocket, session.queue))
+        self.user_sessions.setdefault(user_id, []).append(session)
+        return session
+
+    def disconnect(self, session: Session) -> None:
+        sessions = self.user_sessions.get(session.user_id)
+        if sessions is not None and session in sessions:
+            sessions.remove(session)
+            if not sessions:
+                del self.user_sessions[session.user_id]
+        if session.writer is not None:
+            session.writer.cancel()
+            session.writer = None
+
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue[bytes]) -> None:
+        try:
+            while True:
+                message = await queue.get()
+                batch = [message]
+                size = len(message)
+                while (not queue.empty() and len(batch) < self.batch_max_messages
+                       and size < self.batch_max_bytes):
+                    message = queue.get_nowait()
+                    batch.append(message)
+                    size += len(message)
+                await websocket.send_bytes(b"".join(batch))
+        except (WebSocketDisconnect, RuntimeError):
+            # The socket was closed under us; the endpoint handles cleanup
+            pass
+
+    @staticmethod
+    def _enqueue(queue: asyncio.Queue[bytes], message: bytes) -> None:
+        # Drop the oldest pending message rather than blocking the producer
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+    def send_personal_message(self, message: str | dict[str, str], session: Session) -> None:
+        self._enqueue(session.queue, msgpack.packb(message))
+
+    def join(self, conversation_id: str, session: Session) -> None:
+        self.conversation_sessions.setdefault(conversation_id, []).append(session)
+
+    def leave(self, conversation_id: str, session: Session) -> None:
+        sessions = self.conversation_sessions.get(conversation_id)
+        if sessions is not None and session in sessions:
+            sessions.remove(session)
+            if not sessions:
+                del self.conversation_sessions[conversation_id]
+
+    def send_to_conversation(self, conversation_id: str, message: str | dict[str, str],
+                             sender: Session) -> None:
+        data: bytes = msgpack.packb(message)
+        for session in self.conversation_sessions.get(conversation_id, []):
+            if session is not sender:
+                self._enqueue(session.queue, data)
+
+    def broadcast(self, message: str | dict[str, str]) -> None:
+        data: bytes = msgpack.packb(message)
+        for sessions in self.user_sessions.values():
+            self._enqueue(sessions[-1].queue, data)
+
+    def send_to_user(self, user_id: str, message: str | dict[str, str]) -> None:
+        sessions = self.user_sessions.get(user_id)
+        if sessions:
+            self._enqueue(sessions[-1].queue, msgpack.packb(message))
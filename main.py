@@ -1,10 +1,13 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+import itertools
+import sys
+from collections import deque
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict
-from uuid import uuid4
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, TypeAdapter
+from core import ConnectionManager, FriendRequestsStore
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # CORS settings
 app.add_middleware(
@@ -18,134 +21,178 @@ app.add_middleware(
 # Inmemory database for the assesment
 users_db = {}
 friends_db = {}
-friend_requests_db = {}
+friends_users_cache: dict[str, list["User"]] = {}
 conversations_db = {}
+participants_sets: dict[str, set] = {}
+# Only the most recent messages of each conversation are kept
+MESSAGES_MAXLEN = 1000
+messages_buf: dict[str, deque] = {}
+
+# Ids only need to be unique within this process, so a counter is enough.
+# next() on itertools.count is atomic under the GIL.
+_id_counter = itertools.count(1)
+
+def new_id() -> str:
+    return f"{next(_id_counter):x}"
+
+# Models are immutable once validated; stored instances are shared by reference
+MODEL_CONFIG = ConfigDict(extra="ignore", frozen=True, validate_assignment=False)
 
 class User(BaseModel):
+    model_config = MODEL_CONFIG
+
     id: str
     name: str
 
 class FriendRequest(BaseModel):
-    id: str
+    model_config = MODEL_CONFIG
+
+    id: int
     from_user: str
     to_user: str
 
 class Conversation(BaseModel):
+    model_config = MODEL_CONFIG
+
     id: str
-    participants: List[str]
-    messages: List[str] = []
+    participants: list[str]
+    messages: list[str] = []
 
 class Message(BaseModel):
+    model_config = MODEL_CONFIG
+
     sender: str
     content: str
 
-# Manage real-time conversations
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-
-    async def connect(self, user_id: str, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-
-    def disconnect(self, user_id: str):
-        self.active_connections.pop(user_id, None)
-
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-    async def broadcast(self, message: str):
-        for connection in self.active_connections.values():
-            await connection.send_text(message)
-
-    async def send_to_user(self, user_id: str, message: str):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_text(message)
+# Built once so the list endpoints serialize straight to JSON with pydantic-core
+users_adapter = TypeAdapter(list[User])
+# Serialized get_users response, rebuilt on the first read after a new user
+_users_json_cache: bytes | None = None
 
+friend_requests_db = FriendRequestsStore()
 manager = ConnectionManager()
 
 # API endpoints for user management
 @app.post("/users/", response_model=User)
 async def create_user(name: str):
-    user_id = str(uuid4())
+    global _users_json_cache
+    # Interned so every dict keyed by this user shares the same key object
+    user_id = sys.intern(new_id())
     new_user = User(id=user_id, name=name)
     users_db[user_id] = new_user
-    friends_db[user_id] = []
+    _users_json_cache = None
+    friends_db[user_id] = set()
+    friends_users_cache[user_id] = []
     return new_user
 
-@app.get("/users/", response_model=List[User])
+@app.get("/users/", response_model=list[User])
 async def get_users():
-    return list(users_db.values())
+    global _users_json_cache
+    if _users_json_cache is None:
+        _users_json_cache = users_adapter.dump_json(list(users_db.values()))
+    return Response(_users_json_cache, media_type="application/json")
 
 @app.post("/users/{user_id}/friend_requests/", response_model=FriendRequest)
 async def send_friend_request(user_id: str, friend_id: str):
     if friend_id not in users_db:
         raise HTTPException(status_code=404, detail="User not found")
-    request_id = str(uuid4())
+    request_id = friend_requests_db.add(user_id, friend_id)
     friend_request = FriendRequest(id=request_id, from_user=user_id, to_user=friend_id)
-    friend_requests_db[request_id] = friend_request
-    await manager.send_to_user(friend_id, f"Friend request from {users_db[user_id].name}")
+    manager.send_to_user(friend_id, f"Friend request from {users_db[user_id].name}")
     return friend_request
 
 @app.post("/users/{user_id}/friend_requests/{request_id}/accept/")
-async def accept_friend_request(user_id: str, request_id: str):
-    if request_id not in friend_requests_db:
+async def accept_friend_request(user_id: str, request_id: int):
+    friend_request = friend_requests_db.get(request_id)
+    if friend_request is None:
         raise HTTPException(status_code=404, detail="Friend request not found")
-    friend_request = friend_requests_db[request_id]
-    if friend_request.to_user != user_id:
+    from_user, to_user = friend_request
+    if to_user != user_id:
         raise HTTPException(status_code=403, detail="Cannot accept this friend request")
-    friends_db[friend_request.from_user].append(user_id)
-    friends_db[user_id].append(friend_request.from_user)
-    del friend_requests_db[request_id]
-    await manager.send_to_user(friend_request.from_user, f"Friend request accepted by {users_db[user_id].name}")
+    user = users_db[user_id]
+    friends = friends_db[user_id]
+    # Accepting a second request between the same pair must not list them twice
+    if from_user not in friends:
+        friends.add(from_user)
+        friends_db[from_user].add(user.id)
+        friends_users_cache[from_user].append(user)
+        friends_users_cache[user_id].append(users_db[from_user])
+    friend_requests_db.remove(request_id)
+    manager.send_to_user(from_user, f"Friend request accepted by {user.name}")
     return {"message": "Friend request accepted"}
 
-@app.get("/users/{user_id}/friends/", response_model=List[User])
+@app.get("/users/{user_id}/friends/", response_model=list[User])
 async def get_friends(user_id: str):
-    if user_id not in users_db:
+    friends = friends_users_cache.get(user_id)
+    if friends is None:
         raise HTTPException(status_code=404, detail="User not found")
-    friend_ids = friends_db.get(user_id, [])
-    return [users_db[friend_id] for friend_id in friend_ids]
+    return Response(users_adapter.dump_json(friends), media_type="application/json")
 
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(user_id, websocket)
+    session = await manager.connect(user_id, websocket)
     try:
         while True:
             data = await websocket.receive_text()
-            await manager.send_personal_message(f"Message from {user_id}: {data}", websocket)
+            manager.send_personal_message(f"Message from {user_id}: {data}", session)
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        pass
+    finally:
+        manager.disconnect(session)
 
 # API endpoints for conversation management
 @app.post("/conversations/", response_model=Conversation)
 async def create_conversation(user_id: str, friend_id: str):
     if user_id not in users_db or friend_id not in users_db:
         raise HTTPException(status_code=404, detail="User not found")
-    conversation_id = str(uuid4())
+    conversation_id = new_id()
     conversation = Conversation(id=conversation_id, participants=[user_id, friend_id])
     conversations_db[conversation_id] = conversation
+    participants_sets[conversation_id] = {user_id, friend_id}
+    messages_buf[conversation_id] = deque(maxlen=MESSAGES_MAXLEN)
     return conversation
 
 @app.get("/conversations/{conversation_id}/", response_model=Conversation)
 async def get_conversation(conversation_id: str):
-    if conversation_id not in conversations_db:
+    conversation = conversations_db.get(conversation_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    # Stored conversations are already validated; returning a response directly
+    # skips FastAPI's response_model pass, which stays on the route for docs
+    content = conversation.model_dump()
+    content["messages"] = list(messages_buf[conversation_id])
+    return ORJSONResponse(content)
+
+@app.get("/conversations/{conversation_id}/messages/", response_model=list[str])
+async def list_messages(conversation_id: str, limit: int = Query(100, ge=1, le=MESSAGES_MAXLEN)):
+    messages = messages_buf.get(conversation_id)
+    if messages is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    return conversations_db[conversation_id]
+    # Walk back from the newest message so only `limit` items are visited
+    recent = list(itertools.islice(reversed(messages), limit))
+    recent.reverse()
+    # Buffered messages are plain strings; skip response_model validation
+    return ORJSONResponse(recent)
 
 @app.websocket("/chat/{conversation_id}/{user_id}")
 async def chat(websocket: WebSocket, conversation_id: str, user_id: str):
-    await manager.connect(user_id, websocket)
+    session = await manager.connect(user_id, websocket)
+    # Conversations are never removed, so resolve them once per session
+    conversation = conversations_db.get(conversation_id)
+    is_participant = conversation is not None and user_id in participants_sets[conversation_id]
+    messages = messages_buf.get(conversation_id)
+    if is_participant:
+        manager.join(conversation_id, session)
     try:
         while True:
             data = await websocket.receive_text()
-            message = f"{user_id}: {data}"
-            if conversation_id in conversations_db:
-                conversation = conversations_db[conversation_id]
-                if user_id in conversation.participants:
-                    conversation.messages.append(message)
-                    for participant in conversation.participants:
-                        if participant != user_id:
-                            await manager.send_to_user(participant, message)
+            if is_participant:
+                messages.append(f"{user_id}: {data}")
+                payload = {"conversation_id": conversation_id, "sender": user_id, "content": data}
+                manager.send_to_conversation(conversation_id, payload, session)
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        pass
+    finally:
+        if is_participant:
+            manager.leave(conversation_id, session)
+        manager.disconnect(session)